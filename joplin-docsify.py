@@ -1,18 +1,24 @@
 import dataclasses
 import mimetypes
+import os
 import re
 import sqlite3
+import sys
 import argparse
 import json
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from operator import attrgetter
 from pathlib import Path
-from shutil import copy
+from shutil import copyfile
 from shutil import rmtree
 from typing import Dict
+from typing import FrozenSet
 from typing import List
 from typing import Optional
 from typing import Set
+from typing import Tuple
 from typing import Union
 
 parser = argparse.ArgumentParser(description='Some config...')
@@ -30,24 +36,49 @@ parser.add_argument('-l', '--disable-latest', action='store_true',
                     help='Do not list latest notes on homepage')
 parser.add_argument('-f', '--force', action='store_true',
                     help='Force rebuild even if nothing change')
+parser.add_argument('-c', '--copy-resources', action='store_true',
+                    help='Copy resources instead of hard-linking them')
 args = parser.parse_args()
 
+_SLUG_RE = re.compile(r"[\W_]+")
+_PRIVATE_RE = re.compile(r"\bprivate\b", re.IGNORECASE)
+_LINK_RE = re.compile(r"\]\(:/([a-f0-9]{32})(#.*?)?\)")
 
-def contains_word(word: str, text: str) -> bool:
-    """
-    Check whether `text` contains `word`, as a whole word.
+# Writing notes and copying resources is IO-bound, so use more threads than
+# there are CPUs.
+_IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
-    Case insensitive.
-    """
-    return re.search(f"\\b{word}\\b".lower(), text.lower()) is not None
+
+# Give the per-row types slots where supported, to save memory and speed up
+# attribute access.
+if sys.version_info >= (3, 10):
+    _dataclass = dataclasses.dataclass(slots=True)
+else:
+    _dataclass = dataclasses.dataclass
 
 
 def slugify(text):
     """Convert `text` into a slug."""
-    return re.sub(r"[\W_]+", "_", text).strip("_")
+    return _SLUG_RE.sub("_", text).strip("_")
+
+
+def _write_files(files: List[Tuple[str, bytes]]):
+    """Write each `(path, data)` pair in `files`, in order."""
+    for path, data in files:
+        with open(path, "wb") as outfile:
+            outfile.write(data)
+
 
+def _linkcopy(src: str, dst: str):
+    """Hard-link `src` to `dst`, or copy it if that's not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystems, or no hard links there.
+        copyfile(src, dst)
 
-@dataclasses.dataclass
+
+@_dataclass
 class Folder:
     """A helper type for a folder."""
 
@@ -55,14 +86,28 @@ class Folder:
     parent_id: str
     title: str
     icon: str
+    sort_title: str = dataclasses.field(init=False, repr=False, compare=False)
+    # The folder's path from the top-level folder, set in read_data.
+    path: Optional[str] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+    _url: Optional[str] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        """Lowercase the title once, for sorting."""
+        self.sort_title = self.title.lower()
 
     def is_private(self) -> bool:
         """Return whether this folder is private."""
-        return contains_word("private", self.title)
+        return _PRIVATE_RE.search(self.title) is not None
 
     def get_url(self) -> str:
         """Return the folder's relative URL."""
-        return slugify(self.title)
+        if self._url is None:
+            self._url = slugify(self.title)
+        return self._url
 
     def get_summary_line(self, level: int) -> str:
         """Get the appropriate summary file line for this folder."""
@@ -73,14 +118,14 @@ class Folder:
         if isinstance(other, Note):
             # Folders always come before notes.
             return True
-        return self.title.lower() < other.title.lower()
+        return self.sort_title < other.sort_title
 
     def __repr__(self) -> str:
         """Pretty-print this class."""
         return f"Folder: <{self.title}>"
 
 
-@dataclasses.dataclass
+@_dataclass
 class Note:
     """A helper type for a note."""
 
@@ -88,9 +133,28 @@ class Note:
     folder: Folder
     title: str
     body: str
-    updated_time: datetime
-    created_time: datetime
-    tags: List[str] = dataclasses.field(default_factory=list)
+    # Both in milliseconds since the epoch, as Joplin stores them.
+    updated_time: int
+    created_time: int
+    tags: FrozenSet[str] = frozenset()
+    sort_title: str = dataclasses.field(init=False, repr=False, compare=False)
+    _url: Optional[str] = dataclasses.field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        """Lowercase the title once, for sorting."""
+        self.sort_title = self.title.lower()
+
+    @property
+    def updated_dt(self) -> datetime:
+        """Return the note's update time as a local datetime."""
+        return datetime.fromtimestamp(self.updated_time / 1000)
+
+    @property
+    def created_dt(self) -> datetime:
+        """Return the note's creation time as a local datetime."""
+        return datetime.fromtimestamp(self.created_time / 1000)
 
     def is_public(self) -> bool:
         """
@@ -99,15 +163,17 @@ class Note:
         This function checks a note's tags and returns whether it
         should be published.
         """
-        keywords = ["public"]
-        for keyword in keywords:
-            if keyword in self.tags:
-                return True
-        return False
+        return "public" in self.tags
+
+    def is_homepage(self) -> bool:
+        """Return whether this note is the homepage introduction."""
+        return "public homepage" in self.tags
 
     def get_url(self) -> str:
         """Return the note's relative URL."""
-        return slugify(self.folder.title) + "/" + slugify(self.title)
+        if self._url is None:
+            self._url = self.folder.get_url() + "/" + slugify(self.title)
+        return self._url
 
     def get_summary_line(self, level: int) -> str:
         """
@@ -121,14 +187,14 @@ class Note:
 
     def __lt__(self, other: Union["Folder", "Note"]) -> bool:
         """Support comparison, for sorting."""
-        return self.title.lower() < other.title.lower()
+        return self.sort_title < other.sort_title
 
     def __repr__(self) -> str:
         """Pretty-print this class."""
         return f"Note: <{self.title}>"
 
 
-@dataclasses.dataclass
+@_dataclass
 class Resource:
     """A helper type for a resource."""
 
@@ -151,20 +217,33 @@ class JoplinExporter:
     content_dir = Path(f"{args.docsify}/joplin-notes")
     static_dir = Path(f"{args.docsify}/joplin-resources")
     joplin_dir = Path(args.joplin)
+    use_hardlinks = not args.copy_resources
 
     def __init__(self):
+        # Plain string forms of the directories, for building file paths.
+        self._content_dir_str = str(self.content_dir)
+        self._static_dir_str = str(self.static_dir)
+        self._joplin_resources_str = str(self.joplin_dir / "resources")
+
         self.resources: Dict[str, Resource] = {}
         self.used_resources: Set[str] = set()
 
-        # A mapping of {"note_id": Note()}.
-        self.note_lookup_dict: Dict[str, Note] = {}
-
         # A mapping of {"folder_id": Folder()}.
         self.folders: Dict[str, Folder] = {}
 
-        # A mapping of {"folder_id": [Note(), Note()]}.
+        # A mapping of {"folder_id": [Note(), Note()]}, public notes only.
         self.notes: Dict[str, List[Note]] = defaultdict(list)
 
+        # A mapping of {"item_id": "relative/url"} for link targets. Notes are
+        # added in read_data, resources the first time they're linked to.
+        self.link_urls: Dict[str, str] = {}
+
+        # Every public note with its folder's path, in export order.
+        self.public_notes: List[Tuple[Note, str]] = []
+
+        # The "introduction" note, shown on the homepage.
+        self.introduction: Optional[Note] = None
+
     def clean_content_dir(self):
         """Reset the content directory to a known state to begin."""
         rmtree(self.content_dir, ignore_errors=True)
@@ -174,29 +253,30 @@ class JoplinExporter:
 
     def resolve_note_links(self, note: Note) -> str:
         """Resolve the links between notes and replace them in the body."""
-
-        def replacement(match):
+        body = note.body
+        if "](:/" not in body:
+            # No links at all, don't bother with the regex.
+            return body
+
+        parts = []
+        last = 0
+        link_urls = self.link_urls
+        for match in _LINK_RE.finditer(body):
             item_id = match.group(1)
-            new_url = self.get_note_url_by_id(item_id)
-            if new_url:
-                # new_url += ".html"
-                pass
-            else:
+            new_url = link_urls.get(item_id)
+            if new_url is None:
                 new_url = self.get_resource_url_by_id(item_id)
-                if not new_url:
+                if new_url:
+                    link_urls[item_id] = new_url
+                else:
                     new_url = item_id
             if match.group(2):
                 new_url += match.group(2)
-            return f"](<{new_url}>)"
-
-        return re.sub(r"\]\(:/([a-f0-9]{32})(#.*?)?\)", replacement, note.body)
-
-    def get_note_url_by_id(self, note_id: str) -> Optional[str]:
-        """Return a note's relative URL by its ID."""
-        note = self.note_lookup_dict.get(note_id)
-        if not note:
-            return None
-        return f"{self.parents_path(note.folder.id)}/{note.title}"
+            parts.append(body[last:match.start()])
+            parts.append(f"](<{new_url}>)")
+            last = match.end()
+        parts.append(body[last:])
+        return "".join(parts)
 
     def get_resource_url_by_id(self, resource_id: str) -> Optional[str]:
         """Return a resource's relative URL by its ID."""
@@ -210,13 +290,23 @@ class JoplinExporter:
 
     def copy_resources(self):
         """Copy all the used resources to the output directory."""
+        if not self.used_resources:
+            return
+
+        sources = []
+        destinations = []
         for resource_id in self.used_resources:
             resource = self.resources[resource_id]
-            copy(
-                self.joplin_dir / "resources" /
-                (f"{resource_id}.{resource.extension}"),
-                self.static_dir / f"{resource_id}{resource.derived_ext}",
-            )
+            sources.append(os.path.join(
+                self._joplin_resources_str, f"{resource_id}.{resource.extension}"))
+            destinations.append(os.path.join(
+                self._static_dir_str, f"{resource_id}{resource.derived_ext}"))
+
+        # Overlap the copies in a few threads.
+        copy_resource = _linkcopy if self.use_hardlinks else copyfile
+        with ThreadPoolExecutor(max_workers=_IO_WORKERS) as executor:
+            for _ in executor.map(copy_resource, sources, destinations):
+                pass
 
     def check_new(self, seq):
         seq_file = self.index_dir / "sequence.txt"
@@ -231,32 +321,64 @@ class JoplinExporter:
 
     def read_data(self):
         """Read the data from the Joplin database."""
-        conn = sqlite3.connect(self.joplin_dir / "database.sqlite")
+        # We only ever read, so open the database read-only.
+        database = (self.joplin_dir / "database.sqlite").resolve()
+        conn = sqlite3.connect(f"{database.as_uri()}?mode=ro", uri=True)
         c = conn.cursor()
+        # Fetch rows in batches, the default is one at a time.
+        c.arraysize = 1000
 
+        # Bail out before anything else if nothing changed.
         c.execute("""SELECT seq FROM sqlite_sequence WHERE name='item_changes';""")
         self.check_new(str(c.fetchone()[0]))
 
+        # Let SQLite serve pages from a memory map instead of copying them.
+        c.execute("""PRAGMA query_only=1;""")
+        c.execute("""PRAGMA mmap_size=268435456;""")
+        c.execute("""PRAGMA cache_size=-65536;""")
+        c.execute("""PRAGMA temp_store=MEMORY;""")
+
         c.execute("""SELECT id, title, parent_id, icon FROM folders;""")
-        self.folders = {
-            id: Folder(
-                id, parent_id, title, json.loads(icon).get("emoji", "") if icon else ""
-            )
-            for id, title, parent_id, icon in c.fetchall()
-        }
+        self.folders = {}
+        for rows in iter(c.fetchmany, []):
+            for id, title, parent_id, icon in rows:
+                folder = Folder(
+                    id, parent_id, title, json.loads(icon).get("emoji", "") if icon else ""
+                )
+                if not folder.is_private():
+                    self.folders[id] = folder
+
+        # Build every folder's path once, reusing the paths of its parents.
+        for folder in self.folders.values():
+            pending = []
+            prefix = ""
+            item = folder
+            while item.path is None:
+                pending.append(item)
+                if not item.parent_id:
+                    break
+                item = self.folders.get(item.parent_id)
+                if item is None:
+                    # A parent is private, so these folders are too.
+                    pending = []
+                    break
+            else:
+                prefix = item.path + "/"
+            for item in reversed(pending):
+                item.path = sys.intern(prefix + item.title)
+                prefix = item.path + "/"
 
         self.folders = {
-            id: folder for id, folder in self.folders.items() if not folder.is_private()
+            id: folder for id, folder in self.folders.items() if folder.path is not None
         }
 
-        # Get the tags by ID.
-        c.execute("""SELECT id, title FROM tags;""")
-        tags = {id: title for id, title in c.fetchall()}
-        # Get the tag IDs for each note ID.
-        c.execute("""SELECT note_id, tag_id FROM note_tags;""")
-        note_tags = defaultdict(list)
-        for note_id, tag_id in c.fetchall():
-            note_tags[note_id].append(tags[tag_id])
+        # Get the tag titles for each note ID.
+        c.execute(
+            """SELECT note_tags.note_id, tags.title FROM note_tags JOIN tags ON tags.id = note_tags.tag_id;""")
+        note_tags = defaultdict(set)
+        for rows in iter(c.fetchmany, []):
+            for note_id, tag in rows:
+                note_tags[note_id].add(tag)
 
         c.execute("""SELECT id, title, mime, file_extension FROM resources;""")
 
@@ -266,31 +388,52 @@ class JoplinExporter:
                 extension=ext,
                 mimetype=mime,
             )
-            for id, title, mime, ext in c.fetchall()
+            for rows in iter(c.fetchmany, [])
+            for id, title, mime, ext in rows
         }
 
+        # Notes are the bulk of the data, fetch them in bigger batches.
+        c.arraysize = 10000
         c.execute(
             """SELECT id, parent_id, title, body, updated_time, created_time FROM notes;""")
-        for id, parent_id, title, body, updated_time, created_time in c.fetchall():
-            if parent_id not in self.folders:
-                # This note is in a private folder, continue.
-                continue
+        # Bind these locally, the notes table is by far the largest one.
+        folders = self.folders
+        notes = self.notes
+        for rows in iter(c.fetchmany, []):
+            for id, parent_id, title, body, updated_time, created_time in rows:
+                folder = folders.get(parent_id)
+                if folder is None:
+                    # This note is in a private folder, continue.
+                    continue
 
-            note = Note(
-                id,
-                self.folders[parent_id],
-                title,
-                body,
-                datetime.fromtimestamp(updated_time / 1000),
-                datetime.fromtimestamp(created_time / 1000),
-                tags=note_tags[id],
-            )
+                note = Note(
+                    id,
+                    folder,
+                    title,
+                    body,
+                    updated_time,
+                    created_time,
+                    tags=frozenset(note_tags.get(id, ())),
+                )
+
+                if note.is_homepage():
+                    self.introduction = note
+                if not note.is_public():
+                    continue
 
-            self.notes[note.folder.id].append(note)
-            self.note_lookup_dict[note.id] = note
+                notes[parent_id].append(note)
 
         conn.close()
 
+        self.public_notes = [
+            (note, folder.path)
+            for folder in sorted(self.folders.values(), key=attrgetter("sort_title"))
+            for note in sorted(self.notes.get(folder.id, ()), key=lambda n: n.title)
+        ]
+        self.link_urls = {
+            note.id: f"{path}/{note.title}" for note, path in self.public_notes
+        }
+
     def write_summary(self):
         """Write the _sidebar.md for Docsify."""
         # We construct a note tree by adding each note into its parent.
@@ -301,36 +444,46 @@ class JoplinExporter:
         #     [parent1, parent2, note1]
         #     [parent1, parent3, note2]
         # ]
-        # Then, we sort these by alphabetical order, and we're done.
+        # Then, we sort these by alphabetical order, folders before notes,
+        # and we're done.
         note_tree = []
-        introduction: Optional[Note] = None  # The "introduction" note.
+        introduction = self.introduction
         folders: List[Folder] = list
-        for note_list in self.notes.values():
-            for note in note_list:
-                if "public homepage" in note.tags:
-                    introduction = note
-                    continue
-                if not note.is_public():
-                    continue
-                note_item = [note]
-                item: Union[Folder, Note] = note
-                while True:
-                    if isinstance(item, Note):
-                        item = item.folder
-                    elif isinstance(item, Folder):
-                        item = self.folders.get(item.parent_id)
-                        if not item:
-                            break
-                    note_item.insert(0, item)
-
-                note_tree.append(note_item)
-        note_tree.sort()
+
+        # A folder's parents don't depend on the note, so build the chain
+        # once per folder: {"folder_id": [parent1, parent2, folder]}, along
+        # with the matching sort key.
+        folder_chain: Dict[str, List[Folder]] = {}
+        folder_key: Dict[str, Tuple[Tuple[int, str, str], ...]] = {}
+        for folder in self.folders.values():
+            pending = []
+            item: Optional[Folder] = folder
+            while item and item.id not in folder_chain:
+                pending.append(item)
+                item = self.folders.get(item.parent_id)
+            chain = folder_chain[item.id] if item else []
+            key = folder_key[item.id] if item else ()
+            for item in reversed(pending):
+                chain = chain + [item]
+                # The ID keeps folders with the same title apart.
+                key = key + ((0, item.sort_title, item.id),)
+                folder_chain[item.id] = chain
+                folder_key[item.id] = key
+
+        for note, _ in self.public_notes:
+            if note.is_homepage():
+                continue
+            note_tree.append(folder_chain[note.folder.id] + [note])
+        if len(note_tree) > 1:
+            note_tree.sort(
+                key=lambda chain: folder_key[chain[-1].folder.id]
+                + ((1, chain[-1].sort_title),)
+            )
 
         # Generate the sidebar file.
         items = []
         news = []
-        latest = []
-        ids = []
+        ids: Set[str] = set()
         for note_list in note_tree:
             lvl = 0
             for branch in note_list:
@@ -338,70 +491,69 @@ class JoplinExporter:
                 if isinstance(branch, Folder):
                     if branch.id not in ids:
                         items.append(branch.get_summary_line(lvl))
-                        ids.append(branch.id)
+                        ids.add(branch.id)
                 elif isinstance(branch, Note):
                     news.append(branch)
-                    items.append(("    " * (lvl - 1)) + f"{'- ' if lvl > 0 else ''}[{branch.title}](<{self.parents_path(branch.folder.id)}/{branch.title}>)")
+                    items.append(("    " * (lvl - 1)) + f"{'- ' if lvl > 0 else ''}[{branch.title}](<{self.link_urls[branch.id]}>)")
 
 
+        sidebar_parts = [f"- [{args.name}](/)\n", "\n".join(items)]
         with (self.content_dir / "_sidebar.md").open(mode="w", encoding="utf-8") as outfile:
-            outfile.write(f"- [{args.name}](/)\n")
-            outfile.write("\n".join(items))
-
-        for new in sorted(news, key=lambda n: n.created_time, reverse=True):
-            latest.append(
-                f"[{new.title}](<{self.parents_path(new.folder.id)}/{new.title}>)")
-
-
+            outfile.write("".join(sidebar_parts))
+
+        latest = [
+            f"[{new.title}](<{self.link_urls[new.id]}>)"
+            for new in sorted(news, key=lambda n: n.created_time, reverse=True)
+        ]
+
+        readme_parts = []
+        if introduction:
+            readme_parts.append(f"""{self.resolve_note_links(introduction)}\n\n""")
+        if not args.disable_latest:
+            readme_parts.append("Latest pages:\\\n")
+            readme_parts.append("\\\n".join(latest))
+        elif not introduction:
+            # Docsify needed non-empty README.md to work. So let's add invisible non-breaking space.
+            readme_parts.append('&nbsp;')
         with (self.content_dir / "README.md").open(mode="w", encoding="utf-8") as outfile:
-            if introduction:
-                outfile.write(
-                    f"""{self.resolve_note_links(introduction)}\n\n""")
-                if not args.disable_latest:
-                    outfile.write("Latest pages:\\\n")
-                    outfile.write(f"\\\n".join(latest))
-            else:
-                if not args.disable_latest:
-                    outfile.write("Latest pages:\\\n")
-                    outfile.write(f"\\\n".join(latest))
-                else:
-                    # Docsify needed non-empty README.md to work. So let's add invisible non-breaking space.
-                    outfile.write('&nbsp;')
+            outfile.write("".join(readme_parts))
 
     def export(self):
         """Export all the notes to a static site."""
         self.read_data()
-        folder_list = sorted(self.folders.values())
         self.clean_content_dir()
-        for folder in folder_list:
-            for note in sorted(self.notes[folder.id], key=lambda n: n.title):
-                if note.is_public():
-                    note_dir = self.content_dir / self.parents_path(note.folder.id)
-                    print(f"Exporting note: {self.parents_path(note.folder.id)}/{note.title}")
-                    note_dir.mkdir(parents=True, exist_ok=True)
-                    with (note_dir / (note.title + ".md")).open(mode="w", encoding="utf-8") as outfile:
-                        outfile.write(
-                            f"""> Created: {note.created_time:%c}, updated: {note.updated_time:%c}, in {self.parents_path(note.folder.id)}\n# {note.title}\n{self.resolve_note_links(note)}""")
+        # Only make folders for public notes, each one once.
+        for folder_path in {folder_path for _, folder_path in self.public_notes}:
+            (self.content_dir / folder_path).mkdir(parents=True, exist_ok=True)
+
+        # A mapping of {"path": b"content"}, in the order the files were last
+        # written to. Notes with the same title in the same folder share a
+        # path, and the last one wins.
+        files: Dict[str, bytes] = {}
+        for note, folder_path in self.public_notes:
+            print(f"Exporting note: {folder_path}/{note.title}")
+            path = os.path.join(
+                self._content_dir_str, folder_path, f"{note.title}.md")
+            files.pop(path, None)
+            files[path] = (
+                f"""> Created: {note.created_dt:%c}, updated: {note.updated_dt:%c}, in {folder_path}\n# {note.title}\n{self.resolve_note_links(note)}""".encode("utf-8"))
+
+        # Paths that only differ in case are the same file on some
+        # filesystems, so each such group is written in order by one thread.
+        groups: Dict[str, List[Tuple[str, bytes]]] = defaultdict(list)
+        for path, content in files.items():
+            groups[path.casefold()].append((path, content))
+
+        # Links (and the used resources) are resolved above, one note at a
+        # time, so only the IO-bound writes run in parallel.
+        with ThreadPoolExecutor(max_workers=_IO_WORKERS) as executor:
+            for _ in executor.map(_write_files, groups.values()):
+                pass
         self.write_summary()
         self.copy_resources()
         if not args.save_index:
             self.write_html()
 
-    def parents(self, id: str):
-        """Return list of parent folders titles"""
-        parents = []
-        parents.append(self.folders[id].title)
-        def parent(id):
-            if self.folders[id].parent_id:
-                parents.append(self.folders[self.folders[id].parent_id].title)
-                parent(self.folders[self.folders[id].parent_id].id)
-            return parents
-
-        return parent(id)
-
-    def parents_path(self, id: str):
-        return "/".join(reversed(self.parents(id)))
-
     def write_html(self):
         with (self.index_dir / "index.html").open(mode="w", encoding="utf-8") as outfile:
             outfile.write(f"""